@@ -2,69 +2,66 @@ import spacy
 import re
 import argparse
 import os
-from glob import glob
+import multiprocessing
 import sys
+from itertools import chain
 import spacy.cli
-import nltk
-nltk.download('wordnet')
-nltk.download('omw-1.4')
-from nltk.corpus import wordnet
+from redact_utils import (
+    BATCH_SIZE, UNUSED_COMPONENTS, build_concept_matcher, ensure_wordnet, get_related_words,
+    iter_input_files, make_reader, plan_tasks, read_files, rebuild_pipeline, redact_spans, write_text,
+)
 
 # Load SpaCy model for English language
-nlp = spacy.load("en_core_web_sm")
-
-# Helper function to redact sensitive information
-def redact_entities(doc, entities):
-    redacted_text = doc.text
+def load_pipeline(concept_words):
+    nlp = spacy.load("en_core_web_sm", exclude=UNUSED_COMPONENTS)
+    if concept_words:
+        # Concept redaction needs sentence boundaries; the rule-based
+        # sentencizer is much cheaper than running the dependency parser.
+        nlp.add_pipe("sentencizer")
+    return nlp
+
+# Phone numbers are ASCII-only, so skip Unicode matching for \s
+PHONE_PATTERN = re.compile(r'(\(?\+?[0-9]{1,3}\)?[\s.-]?[0-9]{1,4}[\s.-]?[0-9]{1,4}[\s.-]?[0-9]{1,9})', re.ASCII)
+
+# Helper function to find the character spans of sensitive entities
+def find_entity_spans(entities):
+    spans = []
     stats = []
     
     for ent in entities:
         if ent.label_ in ['PERSON', 'DATE', 'GPE', 'ORG']:  # Handles names, dates, addresses, etc.
-            # Replace with censor character █
-            redacted_text = redacted_text.replace(ent.text, '█' * len(ent.text))
+            spans.append((ent.start_char, ent.end_char))
             stats.append(f"Censored {ent.label_}: {ent.text} at {ent.start_char}-{ent.end_char}")
     
-    return redacted_text, stats
-
-# Helper function to detect and redact phone numbers using regex
-def redact_phone_numbers(text):
-    phone_pattern = re.compile(r'(\(?\+?[0-9]{1,3}\)?[\s.-]?[0-9]{1,4}[\s.-]?[0-9]{1,4}[\s.-]?[0-9]{1,9})')
-    redacted_text = re.sub(phone_pattern, lambda x: '█' * len(x.group()), text)
-    matches = phone_pattern.findall(text)
-    stats = [f"Censored PHONE: {match}" for match in matches]
-    return redacted_text, stats
-
-def get_related_words(concept):
-    """Fetch related words for a given concept using WordNet."""
-    synonyms = set()
-    for syn in wordnet.synsets(concept):
-        for lemma in syn.lemmas():
-            synonyms.add(lemma.name().lower().replace('_', ' '))
-    return synonyms
-
-
-# Helper function for censoring concept-based sentences
-def redact_concept_sentences(doc, concepts):
-    redacted_text = doc.text
+    return spans, stats
+
+# Helper function to detect phone numbers using regex
+def find_phone_spans(text):
+    spans = []
+    stats = []
+    for match in PHONE_PATTERN.finditer(text):
+        spans.append(match.span())
+        stats.append(f"Censored PHONE: {match.group()}")
+    return spans, stats
+
+# Helper function to find concept-based sentences; the stats quote each sentence
+# from the already-redacted text, so censored entities and phones stay hidden
+def find_concept_spans(doc, concept_matcher, text):
+    spans = []
     stats = []
     
-    # for sent in doc.sents:
-    #     if any(concept.lower() in sent.text.lower() for concept in concepts):
-    #         redacted_text = redacted_text.replace(sent.text, '█' * len(sent.text))
-    #         stats.append(f"Censored CONCEPT: {sent.text.strip()}")
-    for sent in doc.sents:
-        if any(word in concepts for word in sent.text.lower().split()):
-            redacted_text = redacted_text.replace(sent.text, "█" * len(sent.text))
-            stats.append(f"Censored CONCEPT: {sent.text.strip()}")
-    return redacted_text, stats
-
-# Function to process each file
-def process_file(file, output_dir, redact_flags, concepts):
-    with open(file, 'r', encoding='utf-8') as f:
-        text = f.read()
-
-    # Process the text using SpaCy
-    doc = nlp(text)
+    # Every sentence containing at least one concept match
+    sents = {doc[start:end].sent for _, start, end in concept_matcher(doc)}
+    for sent in sorted(sents, key=lambda sent: sent.start):
+        spans.append((sent.start_char, sent.end_char))
+        stats.append(f"Censored CONCEPT: {text[sent.start_char:sent.end_char].strip()}")
+    return spans, stats
+
+# Function to process each parsed document
+def process_file(doc, censored_filename, redact_flags, concept_matcher):
+    # Redaction keeps every character offset, so the Doc's spans stay valid
+    # for each stage's redacted text
+    text = doc.text
     stats = []
     
     if 'names' in redact_flags or 'dates' in redact_flags or 'address' in redact_flags:
@@ -77,29 +74,50 @@ def process_file(file, output_dir, redact_flags, concepts):
         if 'address' in redact_flags:
             entities_to_redact.extend([ent for ent in doc.ents if ent.label_ in ['GPE', 'ORG']])
         
-        text, redaction_stats = redact_entities(doc, entities_to_redact)
+        entity_spans, redaction_stats = find_entity_spans(entities_to_redact)
+        text = redact_spans(text, entity_spans)
         stats.extend(redaction_stats)
     
     if 'phones' in redact_flags:
-        # Redact phone numbers
-        text, phone_stats = redact_phone_numbers(text)
+        # Redact phone numbers, matched on the entity-redacted text so they
+        # never reach into an entity (e.g. the year and hour of a DATE)
+        phone_spans, phone_stats = find_phone_spans(text)
+        text = redact_spans(text, phone_spans)
         stats.extend(phone_stats)
     
-    if concepts:
-        # Redact concept-based sentences
-        doc = nlp(text)  # Re-run SpaCy since text may have changed
-        concept_words = set()
-        
-        for concept in concepts:
-            concept_words.update(get_related_words(concept))
-        text, concept_stats = redact_concept_sentences(doc, concept_words)
+    if concept_matcher is not None:
+        # Redact concept-based sentences, found on the same parse as the entities
+        concept_spans, concept_stats = find_concept_spans(doc, concept_matcher, text)
+        text = redact_spans(text, concept_spans)
         stats.extend(concept_stats)
 
     # Save the redacted text to a new file
-    censored_filename = os.path.join(output_dir, os.path.basename(file) + '.censored')
-    with open(censored_filename, 'w', encoding='utf-8') as out_file:
-        out_file.write(text)
+    write_text(censored_filename, text)
+
+    return stats
+
+# Per-process pipeline state used by process_batch
+worker_state = {}
 
+# Helper function to set up the state process_batch runs with
+def set_worker_state(nlp, redact_flags, concept_words):
+    worker_state['nlp'] = nlp
+    worker_state['redact_flags'] = redact_flags
+    worker_state['concept_matcher'] = build_concept_matcher(nlp, concept_words) if concept_words else None
+    worker_state['executor'] = make_reader()
+
+# Pool initializer: rebuild the parent's pipeline from its config and serialized weights
+def init_worker(config, model_bytes, redact_flags, concept_words):
+    set_worker_state(rebuild_pipeline(config, model_bytes), redact_flags, concept_words)
+
+# Function to redact a task of (file, censored_filename) jobs and return their stats
+def process_batch(jobs):
+    nlp = worker_state['nlp']
+    stats = []
+    texts = read_files(jobs, worker_state['executor'])
+    for doc, (_, censored_filename) in nlp.pipe(texts, as_tuples=True, batch_size=BATCH_SIZE):
+        file_stats = process_file(doc, censored_filename, worker_state['redact_flags'], worker_state['concept_matcher'])
+        stats.extend(file_stats)
     return stats
 
 
@@ -113,6 +131,7 @@ def main():
     parser.add_argument('--address', action='store_true', help='Redact addresses')
     parser.add_argument('--concept', action='append', help='Redact specific concept sentences')
     parser.add_argument('--stats', help='File or location to write statistics (stderr, stdout, or file path)', required=True)
+    parser.add_argument('--processes', type=int, help='Number of worker processes for SpaCy (default: CPU count - 1)')
     
     args = parser.parse_args()
 
@@ -131,17 +150,37 @@ def main():
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
-    # Process all files using glob
+    # Expand concepts into related words once, before any worker processes start
+    concept_words = set()
+    if args.concept:
+        ensure_wordnet()
+    for concept in args.concept or []:
+        concept_words.update(get_related_words(concept))
+
+    nlp = load_pipeline(concept_words)
+
+    # Worker processes, leaving one core for the main process.
+    # en_core_web_sm runs on CPU; don't use worker processes with GPU/transformer models.
+    n_process = args.processes or max(1, (os.cpu_count() or 1) - 1)
+    if sys.platform == 'win32' and n_process > 1:
+        print("Note: worker processes are spawned on Windows; for small inputs "
+              "--processes 1 may be faster.", file=sys.stderr)
+
+    # Process all files lazily, batching documents through SpaCy
     stats = []
-    for pattern in args.input:
-        files = glob(pattern)
-        for file in files:
-            file_stats = process_file(file, args.output, redact_flags, args.concept)
-            stats.extend(file_stats)
+    n_workers, batches = plan_tasks(iter_input_files(args.input, args.output), n_process)
+    if n_workers > 1:
+        # Only start as many workers as there are tasks; workers only send back stats
+        initargs = (nlp.config, nlp.to_bytes(), redact_flags, concept_words)
+        with multiprocessing.Pool(n_workers, initializer=init_worker, initargs=initargs) as pool:
+            for batch_stats in pool.imap(process_batch, batches):
+                stats.extend(batch_stats)
+    else:
+        set_worker_state(nlp, redact_flags, concept_words)
+        stats = process_batch(chain.from_iterable(batches))
 
     # Write stats to the appropriate place (stderr, stdout, or file)
     if args.stats == 'stderr':
-        import sys
         print("\n".join(stats), file=sys.stderr)
     elif args.stats == 'stdout':
         print("\n".join(stats))
@@ -0,0 +1,167 @@
+"""Span, I/O and worker helpers shared by main.py and redactor.py."""
+
+import functools
+import glob
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import nltk
+import spacy
+from nltk.corpus import wordnet
+from spacy.matcher import PhraseMatcher
+
+# Pipeline components the redactor never uses; NER in en_core_web_sm has its
+# own tok2vec layer, so the shared tok2vec can go along with tagger/parser.
+UNUSED_COMPONENTS = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+# Number of documents handed to SpaCy per batch in nlp.pipe
+BATCH_SIZE = 50
+
+# Most files handed to a worker process per task; smaller inputs are split
+# evenly across the workers instead (see plan_tasks)
+TASK_SIZE = 200
+
+# Files read ahead of SpaCy (a full pipe batch), and the threads reading them
+READ_AHEAD = BATCH_SIZE
+READ_THREADS = 4
+
+def ensure_wordnet():
+    """Downloads the WordNet data only if it isn't installed yet."""
+    for resource in ('wordnet', 'omw-1.4'):
+        try:
+            nltk.data.find(f'corpora/{resource}')
+        except LookupError:
+            nltk.download(resource, quiet=True)
+
+@functools.lru_cache(maxsize=None)
+def get_related_words(concept):
+    """Fetch related words for a given concept using WordNet."""
+    synonyms = set()
+    for syn in wordnet.synsets(concept):
+        for lemma in syn.lemmas():
+            synonyms.add(lemma.name().lower().replace('_', ' '))
+    return frozenset(synonyms)
+
+def build_concept_matcher(nlp, concept_words):
+    """Builds a case-insensitive PhraseMatcher over the concept words.
+
+    WordNet lemmas can be multi-word phrases ("data processing"), which a
+    per-token membership test never matches.
+    """
+    matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+    matcher.add("CONCEPT", list(nlp.tokenizer.pipe(concept_words)))
+    return matcher
+
+def merge_spans(spans):
+    """Merges overlapping or adjacent (start, end) spans into a sorted, disjoint list."""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def redact_spans(text, spans):
+    """Overwrites (start, end) character spans with █ in a single pass."""
+    if not spans:
+        return text
+    # Nested and overlapping redactions (e.g. a name inside a concept sentence) are filled once
+    spans = merge_spans(spans)
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(text[last:start])
+        parts.append("█" * (end - start))
+        last = end
+    parts.append(text[last:])
+    return "".join(parts)
+
+def iter_input_files(patterns, output_dir):
+    """Lazily expands input patterns into (filepath, output_path) pairs.
+
+    Directories yield the files inside them.
+    """
+    prefix = os.path.join(output_dir, "")
+    for pattern in patterns:
+        for path in glob.iglob(pattern):
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            yield entry.path, prefix + entry.name + ".censored"
+            else:
+                yield path, prefix + os.path.basename(path) + ".censored"
+
+def read_text(filepath):
+    """Reads a UTF-8 file on a reader thread.
+
+    A plain read() releases the GIL during the syscall, so disk reads overlap
+    with parsing; decoding happens afterwards.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    return data.decode('utf-8')
+
+def write_text(path, text):
+    """Writes text as UTF-8 straight to a file descriptor, without newline translation."""
+    data = memoryview(text.encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+def plan_tasks(jobs, n_process):
+    """Splits jobs into worker tasks of at most TASK_SIZE files.
+
+    Returns the number of workers worth starting and an iterator of tasks.
+    Only the first n_process * TASK_SIZE jobs are looked at up front; when the
+    input is smaller than that it is split into about n_process equal tasks,
+    so every started worker gets files to work on.
+    """
+    jobs = iter(jobs)
+    head = list(itertools.islice(jobs, n_process * TASK_SIZE))
+    task_size = max(1, min(TASK_SIZE, -(-len(head) // n_process)))
+    n_tasks = -(-len(head) // task_size)
+    jobs = itertools.chain(head, jobs)
+    return min(n_process, n_tasks), iter(lambda: list(itertools.islice(jobs, task_size)), [])
+
+def make_reader():
+    """Creates the reader threads read_files submits to.
+
+    Workers keep one for the life of the process, not one pool per task.
+    """
+    return ThreadPoolExecutor(max_workers=READ_THREADS)
+
+def read_files(jobs, executor):
+    """Yields (text, (filepath, output_path)) pairs for nlp.pipe, skipping unreadable files.
+
+    The executor's reader threads keep READ_AHEAD files in flight, so disk
+    reads overlap with SpaCy processing the files already handed over.
+    """
+    jobs = iter(jobs)
+    pending = deque((executor.submit(read_text, job[0]), job) for job in itertools.islice(jobs, READ_AHEAD))
+    while pending:
+        future, job = pending.popleft()
+        for next_job in itertools.islice(jobs, 1):
+            pending.append((executor.submit(read_text, next_job[0]), next_job))
+        try:
+            text = future.result()
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error processing file {job[0]}: {e}")
+            continue
+        yield text, job
+
+def rebuild_pipeline(config, model_bytes):
+    """Rebuilds a pipeline in a worker from the parent's config and serialized weights.
+
+    This is cheaper than loading the model from disk again in every worker.
+    """
+    lang_cls = spacy.util.get_lang_class(config["nlp"]["lang"])
+    nlp = lang_cls.from_config(config)
+    nlp.from_bytes(model_bytes)
+    return nlp
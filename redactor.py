@@ -1,93 +1,150 @@
 import argparse
-import glob
+import contextlib
+import multiprocessing
 import os
-import re
 import spacy
-import nltk
-nltk.download('wordnet')
-nltk.download('omw-1.4')
-from nltk.corpus import wordnet
+from spacy.language import Language
+from spacy.matcher import Matcher
+from spacy.util import filter_spans
 import sys
-
-# Load SpaCy model
-nlp = spacy.load("en_core_web_sm")
-
-def add_phone_component(nlp):
-    """Adds a component to recognize phone numbers."""
-    pattern = r'\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}'
-    def phone_recognizer(doc):
-        for match in re.finditer(pattern, doc.text):
-            span = doc.char_span(match.start(), match.end(), label="PHONE")
-            if span is not None:
-                doc.ents += (span,)
+from redact_utils import (
+    BATCH_SIZE, UNUSED_COMPONENTS, build_concept_matcher, ensure_wordnet, get_related_words,
+    iter_input_files, make_reader, plan_tasks, read_files, rebuild_pipeline, redact_spans, write_text,
+)
+
+# Statistics category for each censored entity label
+STATS_CATEGORIES = {"PERSON": "NAMES", "DATE": "DATES", "PHONE": "PHONES", "GPE": "ADDRESS"}
+
+# Write buffer for a statistics file, so per-file records are flushed in large chunks
+STATS_BUFFER_SIZE = 1 << 16
+
+# Token patterns for phone numbers, as split by the English tokenizer: it
+# breaks digit groups apart at "-" and at "(" / ") ", but keeps "." and a
+# ")" with no space after it inside the token. LENGTH guards keep longer
+# digit runs (shape "dddd") out.
+PHONE_PATTERNS = [
+    # 555-123-4567
+    [{"SHAPE": "ddd"}, {"ORTH": "-"}, {"SHAPE": "ddd"}, {"ORTH": "-"}, {"SHAPE": "dddd", "LENGTH": 4}],
+    # (555) 123-4567
+    [{"ORTH": "("}, {"SHAPE": "ddd"}, {"ORTH": ")"}, {"SHAPE": "ddd"}, {"ORTH": "-"}, {"SHAPE": "dddd", "LENGTH": 4}],
+    # (555)123-4567
+    [{"ORTH": "("}, {"SHAPE": "ddd)ddd"}, {"ORTH": "-"}, {"SHAPE": "dddd", "LENGTH": 4}],
+    # 555 123-4567
+    [{"SHAPE": "ddd"}, {"SHAPE": "ddd"}, {"ORTH": "-"}, {"SHAPE": "dddd", "LENGTH": 4}],
+    # 555.123.4567
+    [{"SHAPE": "ddd.ddd.dddd", "LENGTH": 12}],
+    # (555) 123.4567
+    [{"ORTH": "("}, {"SHAPE": "ddd"}, {"ORTH": ")"}, {"SHAPE": "ddd.dddd", "LENGTH": 8}],
+    # 555 123 4567 and (555) 123 4567
+    [{"SHAPE": "ddd"}, {"SHAPE": "ddd"}, {"SHAPE": "dddd", "LENGTH": 4}],
+    [{"ORTH": "("}, {"SHAPE": "ddd"}, {"ORTH": ")"}, {"SHAPE": "ddd"}, {"SHAPE": "dddd", "LENGTH": 4}],
+    # 5551234567
+    [{"SHAPE": "dddd", "LENGTH": 10}],
+]
+
+@Language.factory("phone_recognizer")
+class PhoneRecognizer:
+    """Pipeline component to recognize phone numbers."""
+
+    def __init__(self, nlp, name):
+        self.matcher = Matcher(nlp.vocab)
+        self.matcher.add("PHONE", PHONE_PATTERNS)
+
+    def __call__(self, doc):
+        # Phone spans take priority over overlapping NER entities (e.g. CARDINAL),
+        # even when the entity is the longer span
+        phones = filter_spans(self.matcher(doc, as_spans=True))
+        ents = [ent for ent in doc.ents if not any(ent.start < phone.end and phone.start < ent.end for phone in phones)]
+        doc.ents = phones + ents
         return doc
-    return phone_recognizer
-
-# Add phone recognizer to pipeline
-nlp.add_pipe(add_phone_component(nlp), last=True)
 
-def get_related_words(concept):
-    """Fetch related words for a given concept using WordNet."""
-    synonyms = set()
-    for syn in wordnet.synsets(concept):
-        for lemma in syn.lemmas():
-            synonyms.add(lemma.name().lower().replace('_', ' '))
-    return synonyms
-
-def censor_text(doc, entity_types, concept_words):
-    """Redacts sensitive information based on specified flags."""
-    redacted_text = doc.text
+def load_pipeline(concept_words):
+    """Loads the SpaCy model with only the components needed for censoring."""
+    nlp = spacy.load("en_core_web_sm", exclude=UNUSED_COMPONENTS)
+    # Add phone recognizer to pipeline
+    nlp.add_pipe("phone_recognizer", last=True)
+    if concept_words:
+        # Sentence boundaries for concept censoring, without the parser
+        nlp.add_pipe("sentencizer")
+    return nlp
+
+def censor_text(doc, entity_types, concept_matcher):
+    """Redacts sensitive information based on specified flags.
+
+    Returns the redacted text and a count of censored items per category,
+    both taken from the same walk over the Doc.
+    """
+    spans = []
+    censored_items = dict.fromkeys(["NAMES", "DATES", "PHONES", "ADDRESS", "CONCEPTS"], 0)
 
     # Censor entity types (names, dates, phones, addresses)
     for ent in doc.ents:
         if ent.label_ in entity_types:
-            redacted_text = redacted_text.replace(ent.text, "█" * len(ent.text))
-
-    # Censor concepts (whole sentences containing related words)
-    for sent in doc.sents:
-        if any(word in concept_words for word in sent.text.lower().split()):
-            redacted_text = redacted_text.replace(sent.text, "█" * len(sent.text))
+            spans.append((ent.start_char, ent.end_char))
+            censored_items[STATS_CATEGORIES[ent.label_]] += 1
 
-    return redacted_text
+    # Censor concepts (whole sentences containing related words or phrases)
+    if concept_matcher is not None:
+        sents = {doc[start:end].sent for _, start, end in concept_matcher(doc)}
+        for sent in sents:
+            spans.append((sent.start_char, sent.end_char))
+        censored_items["CONCEPTS"] = len(sents)
 
-def log_statistics(censored_items, filepath, stats_output):
-    """Logs statistics of redacted items."""
-    stats = f"File: {filepath}\n"
-    for item, count in censored_items.items():
-        stats += f"{item}: {count}\n"
-    stats += "\n"
+    return redact_spans(doc.text, spans), censored_items
 
+def open_stats(stats_output):
+    """Opens the statistics stream (stderr, stdout, or a file appended to)."""
     if stats_output == 'stderr':
-        sys.stderr.write(stats)
-    elif stats_output == 'stdout':
-        print(stats)
-    else:
-        with open(stats_output, 'a') as f:
-            f.write(stats)
+        return contextlib.nullcontext(sys.stderr)
+    if stats_output == 'stdout':
+        return contextlib.nullcontext(sys.stdout)
+    return open(stats_output, 'a', buffering=STATS_BUFFER_SIZE)
 
-def censor_file(filepath, entity_types, concept_words, output_dir, stats_output):
-    """Reads and processes the file to censor sensitive information."""
-    with open(filepath, 'r') as f:
-        text = f.read()
+def log_statistics(censored_items, filepath, stats_file):
+    """Logs statistics of redacted items."""
+    lines = [f"File: {filepath}\n", *[f"{item}: {count}\n" for item, count in censored_items.items()], "\n"]
+    stats_file.writelines(lines)
 
-    # Run SpaCy NER and custom censoring
-    doc = nlp(text)
-    redacted_text = censor_text(doc, entity_types, concept_words)
+def censor_file(doc, output_path, entity_types, concept_matcher):
+    """Censors a parsed document, writes the result to output_path and returns its statistics."""
+    # Custom censoring on the SpaCy NER output
+    redacted_text, censored_items = censor_text(doc, entity_types, concept_matcher)
 
     # Write censored output
-    output_path = os.path.join(output_dir, os.path.basename(filepath) + ".censored")
-    with open(output_path, 'w') as f:
-        f.write(redacted_text)
-
-    # Log statistics
-    censored_items = {
-        "NAMES": sum(1 for ent in doc.ents if ent.label_ == "PERSON" and "NAMES" in entity_types),
-        "DATES": sum(1 for ent in doc.ents if ent.label_ == "DATE" and "DATES" in entity_types),
-        "PHONES": sum(1 for ent in doc.ents if ent.label_ == "PHONE" and "PHONES" in entity_types),
-        "ADDRESS": sum(1 for ent in doc.ents if ent.label_ == "GPE" and "ADDRESS" in entity_types),  # Adjust if you want a different label
-        "CONCEPTS": sum(1 for sent in doc.sents if any(word in concept_words for word in sent.text.lower().split()))
-    }
-    log_statistics(censored_items, filepath, stats_output)
+    write_text(output_path, redacted_text)
+
+    return censored_items
+
+# Per-process pipeline state used by process_batch
+worker_state = {}
+
+def set_worker_state(nlp, entity_types, concept_words):
+    """Sets up the pipeline and options process_batch runs with."""
+    worker_state["nlp"] = nlp
+    worker_state["entity_types"] = entity_types
+    worker_state["concept_matcher"] = build_concept_matcher(nlp, concept_words) if concept_words else None
+    worker_state["executor"] = make_reader()
+
+def init_worker(config, model_bytes, entity_types, concept_words):
+    """Pool initializer that rebuilds the parent's pipeline from its config and weights."""
+    set_worker_state(rebuild_pipeline(config, model_bytes), entity_types, concept_words)
+
+def process_batch(jobs):
+    """Censors a task of (filepath, output_path) jobs.
+
+    Returns (filepath, censored_items) pairs for the main process to log.
+    """
+    nlp = worker_state["nlp"]
+    results = []
+    texts = read_files(jobs, worker_state["executor"])
+    for doc, (filepath, output_path) in nlp.pipe(texts, as_tuples=True, batch_size=BATCH_SIZE):
+        try:
+            censored_items = censor_file(doc, output_path, worker_state["entity_types"], worker_state["concept_matcher"])
+        except Exception as e:
+            print(f"Error processing file {filepath}: {e}")
+            continue
+        results.append((filepath, censored_items))
+    return results
 
 def main():
     # Set up argument parser
@@ -100,6 +157,7 @@ def main():
     parser.add_argument('--address', action='store_true', help='Censor addresses')
     parser.add_argument('--concept', action='append', help='Concepts to censor')
     parser.add_argument('--stats', default='stderr', help='Output for statistics')
+    parser.add_argument('--processes', type=int, help='Number of worker processes for SpaCy (default: CPU count - 1)')
     args = parser.parse_args()
 
     # Set up directory
@@ -119,16 +177,35 @@ def main():
     # Prepare concept words if any
     concept_words = set()
     if args.concept:
+        ensure_wordnet()
         for concept in args.concept:
             concept_words.update(get_related_words(concept))
 
-    # Process each file
-    for pattern in args.input:
-        for filepath in glob.glob(pattern):
-            try:
-                censor_file(filepath, entity_types, concept_words, args.output, args.stats)
-            except Exception as e:
-                print(f"Error processing file {filepath}: {e}")
+    nlp = load_pipeline(concept_words)
+
+    # Worker processes, leaving one core for the main process.
+    # en_core_web_sm runs on CPU; don't use worker processes with GPU/transformer models.
+    n_process = args.processes or max(1, (os.cpu_count() or 1) - 1)
+    if sys.platform == 'win32' and n_process > 1:
+        print("Note: worker processes are spawned on Windows; for small inputs "
+              "--processes 1 may be faster.", file=sys.stderr)
+
+    # Process each file, in tasks of at most TASK_SIZE files; only start as
+    # many workers as there are tasks
+    n_workers, batches = plan_tasks(iter_input_files(args.input, args.output), n_process)
+    if n_workers > 1:
+        initargs = (nlp.config, nlp.to_bytes(), entity_types, concept_words)
+        pool = multiprocessing.Pool(n_workers, initializer=init_worker, initargs=initargs)
+        batch_results = pool.imap(process_batch, batches)
+    else:
+        pool = contextlib.nullcontext()
+        set_worker_state(nlp, entity_types, concept_words)
+        batch_results = map(process_batch, batches)
+
+    with pool, open_stats(args.stats) as stats_file:
+        for results in batch_results:
+            for filepath, censored_items in results:
+                log_statistics(censored_items, filepath, stats_file)
 
 if __name__ == '__main__':
     main()